@@ -1,44 +1,160 @@
 from flask import Flask, jsonify, request
+from flask.json.provider import JSONProvider
+import atexit
+import json
 import logging
-from flask_sqlalchemy import SQLAlchemy
+import logging.handlers
+import queue
+import orjson
+import redis
 from flask_swagger_ui import get_swaggerui_blueprint
+from werkzeug.exceptions import HTTPException
+from sqlalchemy import bindparam, delete, lambda_stmt, select, update
 from sqlalchemy.exc import SQLAlchemyError
 from marshmallow import ValidationError
+from flask_session import Session
+from flask_limiter import Limiter, RateLimitExceeded
+from flask_limiter.util import get_remote_address
 from flask_login import LoginManager, current_user, login_user, logout_user, login_required
-from werkzeug.security import check_password_hash
 from flask_restx import Api, Resource, fields
 
 from config import Config
-from models import db, Note, User
+from models import db, Note, User, SessionUser, calibrate_password_hasher, configure_password_hasher
 from schemas import NoteSchema
 
+# JSON-провайдер на orjson: через него проходят jsonify и ответы ресурсов flask-restx
+class OrjsonProvider(JSONProvider):
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 app.config.from_object(Config)
 db.init_app(app)
 
+# Общий пул соединений Redis для сессий и кэша пользователей
+redis_pool = redis.ConnectionPool.from_url(
+    app.config['REDIS_URL'],
+    max_connections=app.config['REDIS_MAX_CONNECTIONS'],
+    socket_keepalive=True,
+)
+redis_client = redis.Redis(connection_pool=redis_pool)
+
+# Хранение сессий в Redis вместо cookie
+app.config['SESSION_REDIS'] = redis_client
+Session(app)
+
+# Ограничение частоты запросов к эндпоинтам с дорогим хэшированием паролей
+limiter = Limiter(get_remote_address, app=app)
+
+def login_username():
+    # Префикс отделяет ключи по имени пользователя от ключей по IP-адресу
+    data = request.get_json(silent=True)
+    return 'user:' + (str(data.get('username', '')) if isinstance(data, dict) else '')
+
 # Инициализация Flask-Login
 login_manager = LoginManager()
 login_manager.init_app(app)
 
+# Схема используется только для валидации входных данных
 note_schema = NoteSchema()
 notes_schema = NoteSchema(many=True)
 
 # Настройка логгера
-logging.basicConfig(level=logging.INFO)  # Уровень логирования INFO
+# Запись и форматирование логов вынесены в фоновый поток: обработчики запросов только кладут записи в очередь
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Стандартный prepare форматирует запись (включая traceback) в потоке запроса;
+        # здесь запись уходит в очередь как есть и форматируется обработчиком QueueListener
+        return record
+
+log_queue = queue.SimpleQueue()
+root_logger = logging.getLogger()
+root_logger.handlers = [DeferredQueueHandler(log_queue)]
+root_logger.setLevel(logging.INFO)  # Уровень логирования INFO
+
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+log_listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+log_listener.start()
+atexit.register(log_listener.stop)
 
 # Создание объекта логгера
 logger = logging.getLogger(__name__)
 
+# Заранее построенные запросы горячих эндпоинтов: lambda_stmt стабилизирует ключ кэша компиляции,
+# поэтому SQL для них компилируется один раз на процесс
+NOTES_LIST_STMT = lambda_stmt(lambda: select(Note)
+                              .where(Note.user_id == bindparam('uid'))
+                              .order_by(Note.id.desc())
+                              .limit(bindparam('limit')))
+NOTES_LIST_AFTER_STMT = lambda_stmt(lambda: select(Note)
+                                    .where(Note.user_id == bindparam('uid'), Note.id < bindparam('cursor'))
+                                    .order_by(Note.id.desc())
+                                    .limit(bindparam('limit')))
+OWNED_NOTE_STMT = lambda_stmt(lambda: select(Note)
+                              .where(Note.id == bindparam('id'), Note.user_id == bindparam('uid')))
+OWNED_NOTE_ID_STMT = lambda_stmt(lambda: select(Note.id)
+                                 .where(Note.id == bindparam('id'), Note.user_id == bindparam('uid')))
+
+def note_to_dict(note):
+    """Сериализация заметки без marshmallow: схема фиксирована, а это горячий путь."""
+    return {'id': note.id, 'title': note.title, 'content': note.content, 'user_id': note.user_id}
+
+# Загрузка пользователя для Flask-Login: сначала из Redis, затем из БД
+@login_manager.user_loader
+def load_user(user_id):
+    key = f'u:{user_id}'
+    try:
+        blob = redis_client.get(key)
+    except redis.RedisError as e:
+        logger.error('Ошибка чтения кэша пользователя: %s', e)
+        blob = None
+
+    if blob:
+        cached = json.loads(blob)
+        return SessionUser(cached['id'], cached['username'])
+
+    # Выбираем только нужные колонки, без гидрации ORM-объекта
+    row = db.session.query(User.id, User.username).filter(User.id == int(user_id)).first()
+    if not row:
+        return None
+
+    try:
+        redis_client.setex(key, app.config['USER_CACHE_TTL'], json.dumps({'id': row.id, 'username': row.username}))
+    except redis.RedisError as e:
+        logger.error('Ошибка записи кэша пользователя: %s', e)
+    return SessionUser(row.id, row.username)
+
 # Создание базы данных и таблицы
 with app.app_context():
     db.create_all()
 
+    configure_password_hasher(app.config['ARGON2_TIME_COST'])
+
+# Разовая калибровка стоимости хэширования паролей под текущий CPU
+@app.cli.command('calibrate-argon2')
+def calibrate_argon2():
+    time_cost = calibrate_password_hasher(app.config['PASSWORD_HASH_BUDGET'])
+    print(f'ARGON2_TIME_COST={time_cost}')
+
 # Создание экземпляра Api
 api = Api(app, version='1.0', title='Notes API', description='API для управления заметками')
 
+# Ответы ресурсов flask-restx сериализуются тем же orjson-провайдером, что и jsonify
+@api.representation('application/json')
+def output_json(data, code, headers=None):
+    response = app.response_class(app.json.dumps(data), status=code, mimetype='application/json')
+    response.headers.extend(headers or {})
+    return response
+
 # Маршрут для регистрации нового пользователя
 @api.route('/register')
 class RegisterResource(Resource):
+    @limiter.limit('3 per minute')
     def post(self):
         try:
             logger.info('Получен запрос на регистрацию')
@@ -48,21 +164,23 @@ class RegisterResource(Resource):
             password = data['password']
 
             if User.query.filter_by(username=username).first():
-                logger.info(f'Имя пользователя уже занято: {username}')
-                return jsonify({'error': f'Имя пользователя уже занято: {username}'}), 400
+                logger.info('Имя пользователя уже занято: %s', username)
+                return {'error': f'Имя пользователя уже занято: {username}'}, 400
 
             user = User(username=username, password=password)
             db.session.add(user)
             db.session.commit()
             logger.info('Пользователь успешно зарегистрирован!')
-            return jsonify({'message': 'Пользователь успешно зарегистрирован!'}), 201  # HTTP-статус 201 (Created)
+            return {'message': 'Пользователь успешно зарегистрирован!'}, 201  # HTTP-статус 201 (Created)
         except SQLAlchemyError as e:
-            logger.error(f'Ошибка при регистрации пользователя: {str(e)}')
-            return jsonify({'error': f'Ошибка при регистрации пользователя! {str(e)}'}), 500  # HTTP-статус 500 (Internal Server Error)
+            logger.error('Ошибка при регистрации пользователя: %s', e)
+            return {'error': f'Ошибка при регистрации пользователя! {str(e)}'}, 500  # HTTP-статус 500 (Internal Server Error)
 
 # Маршрут для входа пользователя в систему
 @api.route('/login')
 class LoginResource(Resource):
+    @limiter.limit('5 per minute')
+    @limiter.limit('5 per minute', key_func=login_username)
     def post(self):
         try:
             data = request.get_json()
@@ -71,17 +189,21 @@ class LoginResource(Resource):
 
             user = User.query.filter_by(username=username).first()
 
-            if not user or not check_password_hash(user.password_hash, password):
+            if not user or not user.check_password(password):
                 logger.error('Неправильное имя пользователя или пароль')
-                return jsonify({'error': 'Неправильное имя пользователя или пароль!'}), 401  # HTTP-статус 401 (Unauthorized)
+                return {'error': 'Неправильное имя пользователя или пароль!'}, 401  # HTTP-статус 401 (Unauthorized)
+
+            # Сохраняем хэш, если он был пересчитан при проверке
+            if db.session.is_modified(user):
+                db.session.commit()
 
             login_user(user)
 
             logger.info('Вход в систему выполнен успешно')
-            return jsonify({'message': 'Вход в систему выполнен успешно!'})
+            return {'message': 'Вход в систему выполнен успешно!'}
         except SQLAlchemyError as e:
-            logger.error(f'Ошибка при входе в систему: {str(e)}')
-            return jsonify({'error': f'Ошибка при входе в систему! {str(e)}'}), 500  # HTTP-статус 500 (Internal Server Error)
+            logger.error('Ошибка при входе в систему: %s', e)
+            return {'error': f'Ошибка при входе в систему! {str(e)}'}, 500  # HTTP-статус 500 (Internal Server Error)
         
 # Маршрут для выхода пользователя из системы
 @api.route('/logout')
@@ -90,102 +212,163 @@ class LogoutResource(Resource):
     def post(self):
         logout_user()
         logger.info('Выход из системы выполнен успешно')
-        return jsonify({'message': 'Выход из системы выполнен успешно!'})
+        return {'message': 'Выход из системы выполнен успешно!'}
+
+# Модель заметки для документации Swagger
+note_model = api.model('Note', {
+    'title': fields.String(required=True, description='Заголовок заметки'),
+    'content': fields.String(required=True, description='Содержимое заметки')
+})
 
 # Маршрут для работы с заметками
 @api.route('/notes')
 class NotesResource(Resource):
-    @api.expect(api.model('Note', {
-        'title': fields.String(required=True, description='Заголовок заметки'),
-        'content': fields.String(required=True, description='Содержимое заметки')
-    }))
+    @api.expect(note_model)
     @login_required
     def post(self):
+        uid = current_user.id
         try:
-            data = request.get_json()
-            title = data['title']
-            content = data['content']
+            data = note_schema.load(request.get_json())
 
-            note = Note(title=title, content=content, user_id=current_user.id)
+            note = Note(user_id=uid, **data)
             db.session.add(note)
             db.session.commit()
 
             logger.info('Заметка успешно создана')
-            return jsonify({'message': 'Заметка успешно создана!'}), 201  # HTTP-статус 201 (Created)
+            return {'message': 'Заметка успешно создана!'}, 201  # HTTP-статус 201 (Created)
         except ValidationError as e:
-            logger.error(f'Ошибка при создании заметки: {str(e)}')
-            return jsonify({'error': f'Ошибка при создании заметки! {str(e)}'}), 400  # HTTP-статус 400 (Bad Request)
+            logger.error('Ошибка при создании заметки: %s', e.messages)
+            return {'error': e.messages}, 400  # HTTP-статус 400 (Bad Request)
         except SQLAlchemyError as e:
-            logger.error(f'Ошибка при создании заметки: {str(e)}')
-            return jsonify({'error': f'Ошибка при создании заметки! {str(e)}'}), 500  # HTTP-статус 500 (Internal Server Error)
+            logger.error('Ошибка при создании заметки: %s', e)
+            return {'error': f'Ошибка при создании заметки! {str(e)}'}, 500  # HTTP-статус 500 (Internal Server Error)
 
     @login_required
     def get(self):
-        notes = Note.query.filter_by(user_id=current_user.id).all()
-        result = notes_schema.dump(notes)
+        uid = current_user.id
+        # Keyset-пагинация: cursor - id последней заметки предыдущей страницы
+        cursor = request.args.get('cursor')
+        if cursor is not None:
+            try:
+                cursor = int(cursor)
+            except ValueError:
+                logger.error('Некорректный курсор: %s', cursor)
+                return {'error': 'Некорректный курсор!'}, 400  # HTTP-статус 400 (Bad Request)
+
+        limit = request.args.get('limit', app.config['NOTES_PER_PAGE'], type=int)
+        limit = min(max(limit, 1), app.config['NOTES_MAX_PER_PAGE'])
+
+        if cursor is not None:
+            result = db.session.execute(NOTES_LIST_AFTER_STMT, {'uid': uid, 'cursor': cursor, 'limit': limit})
+        else:
+            result = db.session.execute(NOTES_LIST_STMT, {'uid': uid, 'limit': limit})
+        notes = result.scalars().all()
+        next_cursor = notes[-1].id if len(notes) == limit else None
 
         logger.info('Заметки успешно получены')
-        return jsonify(result), 200  # HTTP-статус 200 (OK)
+        return {'items': [note_to_dict(note) for note in notes], 'next': next_cursor}, 200  # HTTP-статус 200 (OK)
+
+# Маршрут для пакетного создания заметок
+@api.route('/notes/bulk')
+class NotesBulkResource(Resource):
+    @api.expect([note_model])
+    @login_required
+    def post(self):
+        uid = current_user.id
+        try:
+            payload = request.get_json()
+            if isinstance(payload, list) and len(payload) > app.config['NOTES_BULK_MAX']:
+                logger.error('Слишком много заметок в пакете: %s', len(payload))
+                return {'error': f'Не более {app.config["NOTES_BULK_MAX"]} заметок за запрос!'}, 400  # HTTP-статус 400 (Bad Request)
+
+            data = notes_schema.load(payload)
+
+            # Все заметки добавляются одним коммитом
+            notes = [Note(user_id=uid, **item) for item in data]
+            db.session.add_all(notes)
+            db.session.commit()
+
+            logger.info('Заметки успешно созданы: %s', len(notes))
+            return {'message': 'Заметки успешно созданы!', 'count': len(notes)}, 201  # HTTP-статус 201 (Created)
+        except ValidationError as e:
+            logger.error('Ошибка при создании заметок: %s', e.messages)
+            return {'error': e.messages}, 400  # HTTP-статус 400 (Bad Request)
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            logger.error('Ошибка при создании заметок: %s', e)
+            return {'error': f'Ошибка при создании заметок! {str(e)}'}, 500  # HTTP-статус 500 (Internal Server Error)
 
 # Маршрут для работы с отдельной заметкой
 @api.route('/notes/<int:id>')
 class NoteResource(Resource):
     @login_required
     def get(self, id):
-        note = Note.query.get(id)
+        uid = current_user.id
+        # Фильтр по владельцу: чужие заметки отсекаются на стороне БД
+        note = db.session.execute(OWNED_NOTE_STMT, {'id': id, 'uid': uid}).scalar_one_or_none()
 
-        if not note or note.user_id != current_user.id:
+        if not note:
             logger.error('Заметка не найдена')
-            return jsonify({'error': 'Заметка не найдена!'}), 404  # HTTP-статус 404 (Not Found)
-
-        result = note_schema.dump(note)
+            return {'error': 'Заметка не найдена!'}, 404  # HTTP-статус 404 (Not Found)
 
         logger.info('Заметка успешно получена')
-        return jsonify(result), 200  # HTTP-статус 200 (OK)
+        return note_to_dict(note), 200  # HTTP-статус 200 (OK)
 
     @login_required
     def put(self, id):
-        note = Note.query.get(id)
-
-        if not note or note.user_id != current_user.id:
-            logger.error('Заметка не найдена')
-            return jsonify({'error': 'Заметка не найдена!'}), 404  # HTTP-статус 404 (Not Found)
-
-        data = request.get_json()
-        title = data.get('title', note.title)
-        content = data.get('content', note.content)
-
-        note.title = title
-        note.content = content
-
+        uid = current_user.id
         try:
+            # Частичная валидация: обновляются только переданные поля
+            values = note_schema.load(request.get_json(), partial=True)
+
+            if values:
+                # Один UPDATE на уровне Core, без SELECT и unit-of-work
+                stmt = (update(Note)
+                        .where(Note.id == id, Note.user_id == uid)
+                        .values(**values)
+                        .execution_options(synchronize_session=False))
+                found = db.session.execute(stmt).rowcount
+            else:
+                found = db.session.execute(OWNED_NOTE_ID_STMT, {'id': id, 'uid': uid}).first() is not None
+
+            if not found:
+                logger.error('Заметка не найдена')
+                return {'error': 'Заметка не найдена!'}, 404  # HTTP-статус 404 (Not Found)
+
             db.session.commit()
 
             logger.info('Заметка успешно обновлена')
-            return jsonify({'message': 'Заметка успешно обновлена!'})
+            return {'message': 'Заметка успешно обновлена!'}
+        except ValidationError as e:
+            logger.error('Ошибка при обновлении заметки: %s', e.messages)
+            return {'error': e.messages}, 400  # HTTP-статус 400 (Bad Request)
         except SQLAlchemyError as e:
             db.session.rollback()
-            logger.error(f'Ошибка при обновлении заметки: {str(e)}')
-            return jsonify({'error': f'Ошибка при обновлении заметки! {str(e)}'}), 500  # HTTP-статус 500 (Internal Server Error)
+            logger.error('Ошибка при обновлении заметки: %s', e)
+            return {'error': f'Ошибка при обновлении заметки! {str(e)}'}, 500  # HTTP-статус 500 (Internal Server Error)
 
     @login_required
     def delete(self, id):
-        note = Note.query.get(id)
+        uid = current_user.id
+        try:
+            # Один DELETE на уровне Core, без загрузки заметки в сессию
+            stmt = (delete(Note)
+                    .where(Note.id == id, Note.user_id == uid)
+                    .execution_options(synchronize_session=False))
+            deleted = db.session.execute(stmt).rowcount
 
-        if not note or note.user_id != current_user.id:
-            logger.error('Заметка не найдена')
-            return jsonify({'error': 'Заметка не найдена!'}), 404  # HTTP-статус 404 (Not Found)
+            if not deleted:
+                logger.error('Заметка не найдена')
+                return {'error': 'Заметка не найдена!'}, 404  # HTTP-статус 404 (Not Found)
 
-        try:
-            db.session.delete(note)
             db.session.commit()
 
             logger.info('Заметка успешно удалена')
-            return jsonify({'message': 'Заметка успешно удалена!'})
+            return {'message': 'Заметка успешно удалена!'}
         except SQLAlchemyError as e:
             db.session.rollback()
-            logger.error(f'Ошибка при удалении заметки: {str(e)}')
-            return jsonify({'error': f'Ошибка при удалении заметки! {str(e)}'}), 500  # HTTP-статус 500 (Internal Server Error)
+            logger.error('Ошибка при удалении заметки: %s', e)
+            return {'error': f'Ошибка при удалении заметки! {str(e)}'}, 500  # HTTP-статус 500 (Internal Server Error)
 
 # Маршрут для Swagger UI
 SWAGGER_URL = '/api/docs'
@@ -196,18 +379,37 @@ app.register_blueprint(swaggerui_blueprint, url_prefix=SWAGGER_URL)
 # Обработка ошибок
 @app.errorhandler(400)
 def bad_request(error):
-    logger.error(f'HTTP 400 (Неправильный запрос)')
+    logger.error('HTTP 400 (Неправильный запрос)')
     return jsonify({'error': 'Неправильный запрос!'}), 400
 
 @app.errorhandler(404)
 def not_found(error):
-    logger.error(f'HTTP 404 (Ресурс не найден)')
+    logger.error('HTTP 404 (Ресурс не найден)')
     return jsonify({'error': 'Ресурс не найден!'}), 404
 
+# Ошибки внутри ресурсов flask-restx обрабатывает Api, а не app. Поле message restx
+# отключено (ERROR_INCLUDE_MESSAGE), поэтому тело ошибки всегда формируется здесь
+@api.errorhandler(RateLimitExceeded)
+def too_many_requests(error):
+    logger.error('HTTP 429 (Слишком много запросов)')
+    return {'error': 'Слишком много запросов!'}, 429
+
+@api.errorhandler(HTTPException)
+def api_http_error(error):
+    logger.error('HTTP %s (%s)', error.code, error.name)
+    return {'error': error.description}, error.code
+
+@api.errorhandler
+def api_internal_error(error):
+    logger.error('HTTP 500 (Внутренняя ошибка сервера!)')
+    return {'error': 'Внутренняя ошибка сервера!'}, 500
+
 @app.errorhandler(500)
 def internal_server_error(error):
-    logger.error(f'HTTP 500 (Внутренняя ошибка сервера!)')
+    logger.error('HTTP 500 (Внутренняя ошибка сервера!)')
     return jsonify({'error': 'Внутренняя ошибка сервера!'}), 500
 
+# Встроенный сервер только для разработки. В production WSGI-приложение запускается под granian:
+#   granian --interface wsgi --workers $(nproc) --threads 2 --http 1 app:app
 if __name__ == '__main__':
     app.run()
@@ -0,0 +1,7 @@
+# ASGI-точка входа для запуска под uvicorn-воркерами Gunicorn:
+#   gunicorn -k uvicorn.workers.UvicornWorker -w $(nproc) --worker-connections 1000 'asgi:asgi_app'
+from asgiref.wsgi import WsgiToAsgi
+
+from app import app
+
+asgi_app = WsgiToAsgi(app)
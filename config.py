@@ -1,5 +1,49 @@
 import os
 
+from sqlalchemy.engine import make_url
+
+def is_memory_sqlite(uri):
+    """SQLite в памяти работает на StaticPool, который не принимает параметры QueuePool."""
+    if not uri:
+        return False
+    url = make_url(uri)
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
 class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
-    SQLALCHEMY_TRACK_MODIFICATIONS = False
\ No newline at end of file
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Пул соединений подбирается под число потоков воркера. Файловая SQLite тоже получает QueuePool,
+    # а SQLite в памяти использует StaticPool, поэтому для нее пул не настраивается
+    SQLALCHEMY_ENGINE_OPTIONS = {} if is_memory_sqlite(SQLALCHEMY_DATABASE_URI) else {
+        'pool_size': int(os.environ.get('SQLALCHEMY_POOL_SIZE', 20)),
+        'max_overflow': int(os.environ.get('SQLALCHEMY_MAX_OVERFLOW', 10)),
+        'pool_recycle': 1800,
+        'pool_pre_ping': False,
+    }
+
+    # Размер страницы списка заметок
+    NOTES_PER_PAGE = 50
+    NOTES_MAX_PER_PAGE = 200
+    # Максимальное число заметок в одном запросе /notes/bulk
+    NOTES_BULK_MAX = 100
+
+    REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+    REDIS_MAX_CONNECTIONS = 64
+
+    # flask-restx не добавляет свое поле message: тело ошибки задают обработчики Api
+    ERROR_INCLUDE_MESSAGE = False
+
+    # Ограничение частоты запросов (Flask-Limiter) хранится в том же Redis
+    RATELIMIT_STORAGE_URI = REDIS_URL
+
+    # Серверные сессии в Redis (Flask-Session)
+    SESSION_TYPE = 'redis'
+    SESSION_PERMANENT = False
+    # Время жизни закэшированного пользователя (в секундах)
+    USER_CACHE_TTL = 300
+
+    # time_cost Argon2id; по умолчанию профиль OWASP (t=2). Значение под конкретное железо
+    # подбирается командой `flask calibrate-argon2` и должно совпадать на всех воркерах
+    ARGON2_TIME_COST = int(os.environ.get('ARGON2_TIME_COST', 2))
+    # Бюджет времени (в секундах) на хэширование пароля при калибровке Argon2
+    PASSWORD_HASH_BUDGET = float(os.environ.get('PASSWORD_HASH_BUDGET', 0.25))
\ No newline at end of file
@@ -1,24 +1,80 @@
+import statistics
+import time
+
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash
-from app import db
-
+from werkzeug.security import check_password_hash
+from argon2 import PasswordHasher, extract_parameters
+from argon2.exceptions import InvalidHashError, VerifyMismatchError
 
 db = SQLAlchemy()
 
+# Argon2id с профилем OWASP (m=19 MiB, t=2, p=1)
+MIN_TIME_COST = 2
+ARGON2_MEMORY_COST = 19456
+ARGON2_PARALLELISM = 1
+
+ph = PasswordHasher(time_cost=MIN_TIME_COST, memory_cost=ARGON2_MEMORY_COST, parallelism=ARGON2_PARALLELISM)
+
+def configure_password_hasher(time_cost):
+    """Пересоздает глобальный хэшер с заданным time_cost."""
+    global ph
+    ph = PasswordHasher(time_cost=time_cost, memory_cost=ARGON2_MEMORY_COST, parallelism=ARGON2_PARALLELISM)
+    return ph
+
+def calibrate_password_hasher(budget, samples=3):
+    """Подбирает максимальный time_cost, при котором медианное время хэширования не превышает budget секунд.
+
+    Запускается вручную (flask calibrate-argon2); найденное значение задается всем воркерам через ARGON2_TIME_COST.
+    """
+    time_cost = MIN_TIME_COST
+    while True:
+        candidate = PasswordHasher(time_cost=time_cost + 1, memory_cost=ARGON2_MEMORY_COST, parallelism=ARGON2_PARALLELISM)
+        timings = []
+        for _ in range(samples):
+            t0 = time.perf_counter()
+            candidate.hash('x' * 16)
+            timings.append(time.perf_counter() - t0)
+        if statistics.median(timings) > budget:
+            break
+        time_cost += 1
+
+    return time_cost
+
+def password_needs_rehash(password_hash):
+    """Перехэширование нужно только если сохраненные параметры слабее текущих.
+
+    В отличие от ph.check_needs_rehash, более высокий time_cost не считается расхождением,
+    иначе воркеры с разными настройками перезаписывали бы хэш друг за другом.
+    """
+    params = extract_parameters(password_hash)
+    return (params.type is not ph.type
+            or params.time_cost < ph.time_cost
+            or params.memory_cost < ph.memory_cost
+            or params.parallelism < ph.parallelism)
+
 class Note(db.Model):
+    # Составной индекс покрывает выборку заметок пользователя, отсортированных по id
+    __table_args__ = (db.Index('ix_note_user_id_id', 'user_id', 'id'),)
+    # Пока у моделей нет серверных значений по умолчанию, это не меняет поведения: первичный ключ
+    # и так возвращается через RETURNING (eager_defaults='auto'). Настройка заранее включает
+    # получение будущих server_default/onupdate в том же INSERT/UPDATE
+    __mapper_args__ = {'eager_defaults': True}
+
     id = db.Column(db.Integer, primary_key=True)
-    title = db.Column(db.String(255))
-    description = db.Column(db.Text)
-    status = db.Column(db.String(20))
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    title = db.Column(db.String(255), nullable=False)
+    content = db.Column(db.Text, nullable=False)
 
-    def __init__(self, title, description, status):
+    def __init__(self, title, content, user_id):
         self.title = title
-        self.description = description
-        self.status = status
+        self.content = content
+        self.user_id = user_id
 
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
+    # См. комментарий к Note.__mapper_args__
+    __mapper_args__ = {'eager_defaults': True}
 
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), unique=True, nullable=False)
@@ -26,4 +82,28 @@ class User(UserMixin, db.Model):
 
     def __init__(self, username, password):
         self.username = username
-        self.password_hash = generate_password_hash(password)
\ No newline at end of file
+        self.password_hash = ph.hash(password)
+
+    def check_password(self, password):
+        """Проверяет пароль и при необходимости перехэширует его с текущими параметрами."""
+        try:
+            ph.verify(self.password_hash, password)
+        except VerifyMismatchError:
+            return False
+        except InvalidHashError:
+            # Хэш старого формата (werkzeug PBKDF2)
+            if not check_password_hash(self.password_hash, password):
+                return False
+            self.password_hash = ph.hash(password)
+            return True
+
+        if password_needs_rehash(self.password_hash):
+            self.password_hash = ph.hash(password)
+        return True
+
+class SessionUser(UserMixin):
+    """Облегченное представление пользователя для Flask-Login без ORM-инструментации."""
+
+    def __init__(self, id, username):
+        self.id = id
+        self.username = username
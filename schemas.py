@@ -1,7 +1,10 @@
-from marshmallow import Schema, fields
+from marshmallow import EXCLUDE, Schema, fields
 
 class NoteSchema(Schema):
+    class Meta:
+        unknown = EXCLUDE
+
     id = fields.Int(dump_only=True)
     title = fields.Str(required=True)
-    description = fields.Str(required=True)
-    status = fields.Str(required=True)
+    content = fields.Str(required=True)
+    user_id = fields.Int(dump_only=True)